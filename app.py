@@ -13,6 +13,14 @@ load_dotenv(dotenv_path=".env")
 MODEL_PATH = str(os.getenv("MODEL_PATH"))
 DATA_FOLDER = str(os.getenv("DATA_FOLDER"))
 INDICES_FOLDER = str(os.getenv("INDICES_FOLDER", "indices"))
+# "torch", "onnx" or "openvino"
+EMBEDDING_BACKEND = str(os.getenv("EMBEDDING_BACKEND", "torch"))
+# Optional model file inside MODEL_PATH for the onnx/openvino backends, e.g.
+# "onnx/model_qint8_avx512_vnni.onnx" for an int8 quantized export
+EMBEDDING_MODEL_FILE = str(os.getenv("EMBEDDING_MODEL_FILE", ""))
+
+# Exchanges shown as chat bubbles; older ones are drawn as a single block
+RECENT_EXCHANGES = 3
 
 # Ensure folders exist
 os.makedirs(DATA_FOLDER, exist_ok=True)
@@ -66,7 +74,8 @@ st.markdown("""
 @st.cache_resource(show_spinner=False)
 def get_app_core():
     try:
-        core = EduQueryCore(MODEL_PATH, DATA_FOLDER, INDICES_FOLDER)
+        core = EduQueryCore(MODEL_PATH, DATA_FOLDER,
+                            INDICES_FOLDER, EMBEDDING_BACKEND, EMBEDDING_MODEL_FILE)
         core.ensure_indices_folder()
         return core
     except Exception as e:
@@ -74,6 +83,14 @@ def get_app_core():
         return None
 
 
+# Index checks are cached across reruns and cleared explicitly when
+# knowledge bases change. Subjects are not cached here: EduQueryCore already
+# rescans the data folder only when it changes.
+@st.cache_data(ttl=300, show_spinner=False)
+def get_cached_missing_indices(_core, indices_folder, subjects):
+    return _core.check_missing_indices()
+
+
 app_core = get_app_core()
 
 if app_core:
@@ -99,6 +116,9 @@ st.markdown('<h3 class="sub-header">Ask questions based on subject-specific know
 with st.sidebar:
     st.markdown("### ⚙️ Configuration")
     st.markdown(f"**Model:** {os.path.basename(MODEL_PATH)}")
+    st.markdown(f"**Embedding Backend:** {EMBEDDING_BACKEND}")
+    if EMBEDDING_MODEL_FILE:
+        st.markdown(f"**Embedding Model File:** {EMBEDDING_MODEL_FILE}")
     st.markdown(f"**Data Folder:** {DATA_FOLDER}")
 
     st.markdown("---")
@@ -111,11 +131,9 @@ with st.sidebar:
 
     if st.button("🔄 Refresh Subjects"):
         st.cache_resource.clear()
+        st.cache_data.clear()
         st.rerun()
 
-if app_core:
-    subjects = app_core.get_subjects()
-
 if not subjects:
     st.warning(
         f"No subject folders found in the data directory: {DATA_FOLDER}")
@@ -156,7 +174,8 @@ if not subjects:
     st.stop()
 
 if app_core:
-    missing_indices = app_core.check_missing_indices()
+    missing_indices = get_cached_missing_indices(
+        app_core, INDICES_FOLDER, tuple(subjects))
 
 if missing_indices:
     if len(missing_indices) == len(subjects):
@@ -175,7 +194,10 @@ if missing_indices:
 
         with st.spinner("Processing knowledge bases..."):
             if app_core:
-                if app_core.initialize_knowledge_bases(update_progress):
+                success = app_core.initialize_knowledge_bases(update_progress)
+                get_cached_missing_indices.clear()
+                st.session_state.pop("last_query", None)
+                if success:
                     st.success("✅ Knowledge bases processed successfully!")
                     missing_indices = []
                 else:
@@ -190,7 +212,10 @@ with col1:
         if st.button(f"Initialize {selected_subject}"):
             with st.spinner(f"Building knowledge base for {selected_subject}..."):
                 if app_core:
-                    if app_core.initialize_subject(selected_subject):
+                    success = app_core.initialize_subject(selected_subject)
+                    get_cached_missing_indices.clear()
+                    st.session_state.pop("last_query", None)
+                    if success:
                         st.success(
                             f"✅ {selected_subject} knowledge base created!")
                         missing_indices.remove(selected_subject)
@@ -198,52 +223,65 @@ with col1:
                         st.error(
                             f"❌ Failed to create {selected_subject} knowledge base.")
 
-with col2:
+# The question box and chat history form a fragment, so asking a question
+# reruns only this part of the page instead of the whole script. Changing the
+# subject or initializing a knowledge base still reruns everything.
+@st.fragment
+def chat_area(selected_subject, missing_indices):
     query = st.text_input("Ask a question:")
 
-if query:
-    st.session_state.messages.append({"role": "user", "content": query})
-    with st.chat_message("user"):
-        st.markdown(query)
+    # Number of trailing messages already rendered while streaming this run
+    streamed_messages = 0
+
+    # text_input keeps its value across reruns, so only answer a question
+    # once per subject rather than on every widget interaction. The key is
+    # reset after a knowledge base is built so the question can be retried.
+    if query and (query, selected_subject) != st.session_state.get("last_query"):
+        st.session_state.last_query = (query, selected_subject)
+        st.session_state.messages.append({"role": "user", "content": query})
+
+        if selected_subject in missing_indices:
+            error_message = f"Knowledge base for {selected_subject} not found. Please initialize it first."
+            st.error(error_message)
+            st.session_state.messages.append(
+                {"role": "assistant", "content": error_message})
+        elif app_core is None:
+            error_message = "Application core is not initialized properly. Please refresh the page."
+            st.error(error_message)
+            st.session_state.messages.append(
+                {"role": "assistant", "content": error_message})
+        else:
+            # Show the new exchange right away and stream the answer into it
+            with st.chat_message("user"):
+                st.markdown(query)
+            with st.chat_message("assistant"):
+                synthesized_answer = st.write_stream(
+                    app_core.get_answer_stream(query, selected_subject))
+
+            st.session_state.messages.append(
+                {"role": "assistant", "content": synthesized_answer})
+            streamed_messages = 2
+
+    # Render the history once, newest exchange first; each exchange is a
+    # user message followed by its answer.
+    messages = st.session_state.messages
+    exchange_starts = range(len(messages) - streamed_messages - 2, -1, -2)
+    for i in exchange_starts[:RECENT_EXCHANGES]:
+        for message in messages[i:i + 2]:
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+
+    # Older exchanges go into one markdown element instead of one chat
+    # message element per message
+    older = ["\n\n".join(f"**{message['role'].capitalize()}:** {message['content']}"
+                         for message in messages[i:i + 2])
+             for i in exchange_starts[RECENT_EXCHANGES:]]
+    if older:
+        st.markdown("\n\n---\n\n".join(older))
 
-    if selected_subject in missing_indices:
-        error_message = f"Knowledge base for {selected_subject} not found. Please initialize it first."
-        st.error(error_message)
-        st.session_state.messages.append(
-            {"role": "assistant", "content": error_message})
-        with st.chat_message("assistant"):
-            st.markdown(error_message)
-    elif app_core is None:
-        error_message = "Application core is not initialized properly. Please refresh the page."
-        st.error(error_message)
-        st.session_state.messages.append(
-            {"role": "assistant", "content": error_message})
-        with st.chat_message("assistant"):
-            st.markdown(error_message)
-    else:
-        with st.spinner("Finding and synthesizing answer..."):
-            synthesized_answer = app_core.get_answer(query, selected_subject)
-
-        with st.chat_message("assistant"):
-            st.markdown(synthesized_answer)
-
-        st.session_state.messages.append(
-            {"role": "assistant", "content": synthesized_answer})
-
-messages = st.session_state.messages
-num_messages = len(messages)
 
-for i in range(num_messages - 1, 0, -2):
-    assistant_message = messages[i]
-    user_message = messages[i-1]
-
-    if user_message["role"] == "user":
-        with st.chat_message(user_message["role"]):
-            st.markdown(user_message["content"])
-
-    if assistant_message["role"] == "assistant":
-        with st.chat_message(assistant_message["role"]):
-            st.markdown(assistant_message["content"])
+with col2:
+    chat_area(selected_subject, missing_indices)
 
 
 # Footer
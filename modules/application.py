@@ -1,26 +1,102 @@
 import os
+import asyncio
 import logging
-from typing import List, Dict, Optional, Callable, Any
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Optional, Callable, Any, Iterator, Tuple
 from sentence_transformers import SentenceTransformer
+import numpy as np
+import torch
 from .subject_processor import (
     get_available_subjects,
     process_subject_knowledge_base,
-    get_answer_for_subject  
+    create_extraction_executor,
+    EXTRACTION_WORKERS,
+    encode_queries,
+    get_answers_for_subject
 )
-from .synthesizer import synthesize_answer_with_llm
+from .synthesizer import synthesize_answer_with_llm, synthesize_answer_stream
 
 logger = logging.getLogger(__name__)
 
+# Intra-op threads for torch; 0 keeps torch's default of one per core. When
+# several sessions query at once, fewer threads per call avoids oversubscribing
+# the CPU.
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", "0"))
+
+# Questions answered at the same time by aget_answers. Retrieval overlaps;
+# generation is serialized by the synthesizer, which shares one model
+ANSWER_CONCURRENCY = int(os.getenv("ANSWER_CONCURRENCY", "8"))
+
+# Queries whose best retrieved chunk scores below this cosine similarity are
+# answered with NO_RELEVANT_CONTEXT_MESSAGE without running the synthesis
+# model; 0 or less turns the check off, since scores can be negative
+MIN_RELEVANCE_SCORE = float(os.getenv("MIN_RELEVANCE_SCORE", "0.3"))
+NO_RELEVANT_CONTEXT_MESSAGE = "The provided context does not contain specific information to answer this query in detail."
+
+# Files whose presence marks a subject's knowledge base as built
+REQUIRED_INDEX_FILES = {"faiss_index.idx", "chunks.json"}
+
+# Number of recent query embeddings kept so repeated questions skip encoding
+QUERY_EMBEDDING_CACHE_SIZE = 512
+# Number of recent (subject, query) retrieval results kept
+RETRIEVAL_CACHE_SIZE = 256
+# Seconds a check_subject_index result is reused before the files are
+# looked up again
+INDEX_PRESENCE_TTL = 5.0
+
+# Set EDUQUERY_SEMCACHE=1 to reuse answers across paraphrased questions: an
+# answer is reused when a new query's embedding has at least
+# SEMANTIC_CACHE_THRESHOLD cosine similarity to an earlier one and the same
+# chunks were retrieved for both.
+SEMANTIC_CACHE = os.getenv("EDUQUERY_SEMCACHE", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_SIZE = 256
+
+# Embedding models shared by every EduQueryCore in the process, keyed by
+# (model path, backend, model file), so a new core (e.g. after the Streamlit
+# resource cache is cleared) reuses the resident model instead of reloading
+_MODELS: Dict[Tuple[str, str, str], SentenceTransformer] = {}
+_MODEL_LOCK = threading.Lock()
+
+# Subjects built at the same time, sharing one extraction process pool, so
+# one subject's documents are extracted while another's are encoded
+SUBJECT_WORKERS = 2
+
+
+def semantic_chunk_keys(retrieved_chunks: List[Dict[str, Any]]) -> Tuple[Tuple[str, str], ...]:
+    """Identifies the retrieved chunks an answer was generated from."""
+    return tuple(sorted((chunk.get("source", ""), chunk.get("id", ""))
+                        for chunk in retrieved_chunks))
+
 
 class EduQueryCore:
-    def __init__(self, model_path: str, data_folder: str, indices_folder: str):
+    def __init__(self, model_path: str, data_folder: str, indices_folder: str, embedding_backend: str = "torch", embedding_model_file: str = ""):
         self.model_path = model_path
+        self.embedding_backend = embedding_backend
+        self.embedding_model_file = embedding_model_file
+        # Identifies the embeddings in the per-document embedding cache; a
+        # quantized model file produces different vectors than the full one
+        self.embedding_model_name = f"{model_path}#{embedding_model_file}" \
+            if embedding_model_file else model_path
         self.data_folder = data_folder
         self.indices_folder = indices_folder
         self.model: Optional[SentenceTransformer] = None
         self.subjects: List[str] = []
+        self.query_embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.retrievals: "OrderedDict[Tuple[str, str], List[Dict[str, Any]]]" = OrderedDict()
+        # (subject, query) -> (normalized query embedding, retrieved chunk
+        # keys, answer), used when SEMANTIC_CACHE is on
+        self.semantic_answers: "OrderedDict[Tuple[str, str], Tuple[np.ndarray, Tuple[Tuple[str, str], ...], str]]" = OrderedDict()
+        # Guards these caches; answers may be computed on several threads
+        self.cache_lock = threading.Lock()
+        self.subjects_signature: Optional[int] = None
+        # subject -> (time checked, index present)
+        self.index_presence: Dict[str, Tuple[float, bool]] = {}
         self.ensure_indices_folder()
-        self.subjects = get_available_subjects(self.data_folder)
+        self.get_subjects()
 
     def ensure_indices_folder(self):
         os.makedirs(self.indices_folder, exist_ok=True)
@@ -30,50 +106,157 @@ class EduQueryCore:
         if self.model:
             logger.info("Embedding model already loaded.")
             return True
-        try:
-            if not os.path.exists(self.model_path):
-                logger.error(f"Model path does not exist: {self.model_path}")
+        key = (self.model_path, self.embedding_backend,
+               self.embedding_model_file)
+        # Held while loading so concurrent sessions do not load it twice
+        with _MODEL_LOCK:
+            if key in _MODELS:
+                logger.info("Reusing embedding model loaded by another core.")
+                self.model = _MODELS[key]
+                return True
+            try:
+                if TORCH_THREADS > 0 and torch.get_num_threads() != TORCH_THREADS:
+                    logger.info(f"Using {TORCH_THREADS} torch threads.")
+                    torch.set_num_threads(TORCH_THREADS)
+                if not os.path.exists(self.model_path):
+                    logger.error(
+                        f"Model path does not exist: {self.model_path}")
+                    return False
+                logger.info(
+                    f"Loading embedding model from: {self.model_path} (backend: {self.embedding_backend})")
+                # The onnx/openvino backends export the model on first load if
+                # the model folder does not already contain an exported copy.
+                # A model file selects e.g. an int8 quantized ONNX export.
+                model_kwargs = {}
+                if self.embedding_model_file:
+                    model_kwargs["file_name"] = self.embedding_model_file
+                model = SentenceTransformer(
+                    self.model_path, device='cpu', backend=self.embedding_backend,
+                    model_kwargs=model_kwargs)
+                # Pay one-off lazy initialisation now rather than on the first query
+                model.encode(["warmup"], show_progress_bar=False)
+                _MODELS[key] = model
+                self.model = model
+                logger.info("Embedding model loaded successfully onto CPU.")
+                return True
+            except Exception as e:
+                logger.error(f"Failed to load embedding model: {e}")
+                self.model = None
                 return False
-            logger.info(f"Loading embedding model from: {self.model_path}")
-            self.model = SentenceTransformer(self.model_path, device='cpu')
-            logger.info("Embedding model loaded successfully onto CPU.")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to load embedding model: {e}")
-            self.model = None
-            return False
 
     def unload_model(self):
         """Unloads the sentence transformer model."""
         if self.model:
             logger.info("Unloading embedding model.")
+            with _MODEL_LOCK:
+                _MODELS.pop((self.model_path, self.embedding_backend,
+                             self.embedding_model_file), None)
             del self.model
             self.model = None
+            self.query_embeddings.clear()
             logger.info("Embedding model unloaded.")
         else:
             logger.info("Embedding model not loaded, nothing to unload.")
 
+    def get_query_embedding(self, query: str) -> np.ndarray:
+        """Returns the query's embedding, encoding it only on a cache miss."""
+        return self.get_query_embeddings([query])
+
+    def get_query_embeddings(self, queries: List[str]) -> np.ndarray:
+        """
+        Returns an (n, dim) matrix of query embeddings; cache misses are
+        encoded together in one call.
+        """
+        embeddings: Dict[str, np.ndarray] = {}
+        with self.cache_lock:
+            for query in queries:
+                embedding = self.query_embeddings.get(query)
+                if embedding is not None:
+                    self.query_embeddings.move_to_end(query)
+                    embeddings[query] = embedding
+        missing = list(dict.fromkeys(
+            query for query in queries if query not in embeddings))
+        if missing:
+            encoded = encode_queries(missing, self.model)
+            with self.cache_lock:
+                for query, embedding in zip(missing, encoded):
+                    embedding = embedding.reshape(1, -1)
+                    embeddings[query] = embedding
+                    self.query_embeddings[query] = embedding
+                    if len(self.query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+                        self.query_embeddings.popitem(last=False)
+        return np.vstack([embeddings[query] for query in queries])
+
+    def forget_retrievals(self, subject: str):
+        """Drops cached retrievals, answers and index presence of a subject whose index changed."""
+        with self.cache_lock:
+            for key in [key for key in self.retrievals if key[0] == subject]:
+                del self.retrievals[key]
+            for key in [key for key in self.semantic_answers if key[0] == subject]:
+                del self.semantic_answers[key]
+        self.index_presence.pop(subject, None)
+
     def get_subjects(self) -> List[str]:
-        """Returns the list of available subjects."""
-        self.subjects = get_available_subjects(self.data_folder)
+        """
+        Returns the list of available subjects, rescanning the data folder
+        only when it has been modified or after a knowledge base rebuild.
+        """
+        signature = self.get_subjects_signature()
+        if signature is None or signature != self.subjects_signature:
+            self.subjects = get_available_subjects(self.data_folder)
+            self.subjects_signature = signature
         return self.subjects
 
+    def get_subjects_signature(self) -> Optional[int]:
+        """
+        Modification time of the data folder, which changes when a subject
+        folder is added, removed or renamed. Files added to an existing
+        folder are picked up after the next rebuild.
+        """
+        try:
+            return os.stat(self.data_folder).st_mtime_ns
+        except OSError:
+            return None
+
     def check_missing_indices(self) -> List[str]:
         """Checks which subjects are missing their index files."""
+        # One listing of the indices folder plus one per built subject,
+        # instead of two existence checks per subject
+        try:
+            with os.scandir(self.indices_folder) as entries:
+                built = {entry.name: entry.path
+                         for entry in entries if entry.is_dir()}
+        except FileNotFoundError:
+            built = {}
         missing = []
         for subject in self.subjects:
-            if not self.check_subject_index(subject):
+            if subject not in built:
+                missing.append(subject)
+                continue
+            try:
+                with os.scandir(built[subject]) as entries:
+                    names = {entry.name for entry in entries}
+            except FileNotFoundError:
+                # Removed since the indices folder was listed
+                names = set()
+            if not REQUIRED_INDEX_FILES.issubset(names):
                 missing.append(subject)
         return missing
 
     def check_subject_index(self, subject: str) -> bool:
         """Checks if the necessary index files exist for a subject."""
+        cached = self.index_presence.get(subject)
+        if cached is not None and time.monotonic() - cached[0] < INDEX_PRESENCE_TTL:
+            return cached[1]
         subject_indices_folder = os.path.join(self.indices_folder, subject)
         faiss_index_file = os.path.join(
             subject_indices_folder, "faiss_index.idx")
         chunks_file = os.path.join(subject_indices_folder, "chunks.json")
         # bm25_file = os.path.join(subject_indices_folder, "bm25.json") # BM25 check optional
-        return os.path.exists(faiss_index_file) and os.path.exists(chunks_file)
+        present = os.path.exists(
+            faiss_index_file) and os.path.exists(chunks_file)
+        self.index_presence[subject] = (time.monotonic(), present)
+        return present
 
     def initialize_knowledge_bases(self, progress_callback: Optional[Callable[[str, float], None]] = None) -> bool:
         """Initializes knowledge bases for all subjects."""
@@ -84,20 +267,36 @@ class EduQueryCore:
                 "Cannot initialize knowledge bases: Failed to load embedding model.")
             return False
 
-        try:
-            total_subjects = len(self.subjects)
-            for i, subject in enumerate(self.subjects):
+        # The model stays loaded afterwards: the app queries with it next
+        total_subjects = len(self.subjects)
+        with create_extraction_executor(EXTRACTION_WORKERS) as extraction_executor, \
+                ThreadPoolExecutor(max_workers=SUBJECT_WORKERS) as subject_executor:
+            futures = {}
+            for subject in self.subjects:
                 logger.info(f"Processing subject: {subject}")
-                if not process_subject_knowledge_base(self.data_folder, self.indices_folder, subject, self.model):
+                future = subject_executor.submit(
+                    process_subject_knowledge_base, self.data_folder, self.indices_folder,
+                    subject, self.model, self.embedding_model_name, extraction_executor)
+                futures[future] = subject
+
+            # Progress is reported from this thread as subjects finish, since
+            # the callback may update Streamlit elements
+            for i, future in enumerate(as_completed(futures)):
+                subject = futures[future]
+                if not future.result():
                     logger.error(
                         f"Failed to process knowledge base for {subject}")
                     all_successful = False
                 if progress_callback:
                     progress_callback(subject, (i + 1) / total_subjects)
-            return all_successful
-        finally:
-            # --- Unload model after processing ---
-            self.unload_model()
+        with self.cache_lock:
+            self.retrievals.clear()
+            self.semantic_answers.clear()
+        self.index_presence.clear()
+        # Rescan subjects on the next call; a previously empty subject folder
+        # may have gained documents without changing the data folder
+        self.subjects_signature = None
+        return all_successful
 
     def initialize_subject(self, subject: str) -> bool:
         """Initializes the knowledge base for a single subject."""
@@ -107,53 +306,169 @@ class EduQueryCore:
                 f"Cannot initialize subject '{subject}': Failed to load embedding model.")
             return False
 
-        try:
-            if subject not in self.subjects:
-                logger.error(f"Subject '{subject}' not found in data folder.")
-                return False
-            logger.info(f"Initializing knowledge base for subject: {subject}")
-            success = process_subject_knowledge_base(
-                self.data_folder, self.indices_folder, subject, self.model)
-            if success:
-                logger.info(
-                    f"Successfully initialized knowledge base for {subject}")
-            else:
-                logger.error(
-                    f"Failed to initialize knowledge base for {subject}")
-            return success
-        finally:
-            self.unload_model()
+        if subject not in self.subjects:
+            logger.error(f"Subject '{subject}' not found in data folder.")
+            return False
+        logger.info(f"Initializing knowledge base for subject: {subject}")
+        success = process_subject_knowledge_base(
+            self.data_folder, self.indices_folder, subject, self.model, self.embedding_model_name)
+        self.forget_retrievals(subject)
+        if success:
+            logger.info(
+                f"Successfully initialized knowledge base for {subject}")
+        else:
+            logger.error(
+                f"Failed to initialize knowledge base for {subject}")
+        return success
 
-    def get_answer(self, query: str, subject: str) -> Optional[str]:
-        """Retrieves relevant chunks and synthesizes a final answer using an LLM."""
+    def retrieve_chunks(self, query: str, subject: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
+        """
+        Retrieves the chunks relevant to a query. Returns the chunks, or None
+        and a message for the user when there is nothing to synthesize from.
+        """
+        return self.retrieve_chunks_batch([query], subject)[0]
+
+    def retrieve_chunks_batch(self, queries: List[str], subject: str) -> List[Tuple[Optional[List[Dict[str, Any]]], Optional[str]]]:
+        """
+        retrieve_chunks for several queries. Queries missing from the
+        retrieval cache are embedded and searched as one batch.
+        """
         if not self.model:
             logger.info(
                 "Embedding model not loaded for get_answer, loading now.")
             if not self.load_model():
-                return "Error: The embedding model required for searching could not be loaded."
+                return [(None, "Error: The embedding model required for searching could not be loaded.")] * len(queries)
 
         if not self.check_subject_index(subject):
             logger.warning(
                 f"Subject index not found or incomplete for {subject}")
-            return f"Error: The knowledge base for '{subject}' has not been initialized or is incomplete."
+            return [(None, f"Error: The knowledge base for '{subject}' has not been initialized or is incomplete.")] * len(queries)
 
         # 1. Retrieve relevant chunks (using the function that returns List[Dict])
         logger.info(
-            f"Retrieving chunks for query: '{query}' in subject: '{subject}'")
-        retrieved_chunks = get_answer_for_subject(
-            query.lower(), subject, self.indices_folder, self.model
-        )
+            f"Retrieving chunks for {len(queries)} query(s) in subject: '{subject}'")
+        queries_lower = [query.lower().strip() for query in queries]
+        retrieved: Dict[str, Optional[List[Dict[str, Any]]]] = {}
+        with self.cache_lock:
+            for query_lower in queries_lower:
+                cache_key = (subject, query_lower)
+                retrieved_chunks = self.retrievals.get(cache_key)
+                if retrieved_chunks is not None:
+                    self.retrievals.move_to_end(cache_key)
+                    retrieved[query_lower] = retrieved_chunks
+        if retrieved:
+            logger.info(
+                f"Using cached retrieval results for {len(retrieved)} query(s).")
 
-        # Handle case where retrieval itself fails or returns None
+        missing = list(dict.fromkeys(
+            query_lower for query_lower in queries_lower if query_lower not in retrieved))
+        if missing:
+            results = get_answers_for_subject(
+                missing, subject, self.indices_folder, self.model,
+                query_embeddings=self.get_query_embeddings(missing)
+            )
+            if results is None:
+                results = [None] * len(missing)
+            with self.cache_lock:
+                for query_lower, retrieved_chunks in zip(missing, results):
+                    retrieved[query_lower] = retrieved_chunks
+                    if retrieved_chunks:
+                        self.retrievals[(subject, query_lower)] = retrieved_chunks
+                        if len(self.retrievals) > RETRIEVAL_CACHE_SIZE:
+                            self.retrievals.popitem(last=False)
+
+        outcomes = []
+        for query_lower in queries_lower:
+            retrieved_chunks = retrieved[query_lower]
+            # Handle case where retrieval itself fails or returns None
+            if retrieved_chunks is None:
+                logger.error(f"Chunk retrieval failed for subject {subject}.")
+                # Provide a more specific error if possible, otherwise generic
+                outcomes.append(
+                    (None, "Error: Failed to retrieve information from the knowledge base. Check logs."))
+            elif not retrieved_chunks:
+                logger.warning("No relevant chunks found by retrieval process.")
+                # Return a user-friendly message indicating nothing was found
+                outcomes.append(
+                    (None, "Sorry, I couldn't find relevant information for your query in the knowledge base."))
+            elif MIN_RELEVANCE_SCORE > 0 and \
+                    max(chunk["score"] for chunk in retrieved_chunks) < MIN_RELEVANCE_SCORE:
+                logger.info(
+                    "Best chunk is below MIN_RELEVANCE_SCORE, skipping synthesis.")
+                outcomes.append((None, NO_RELEVANT_CONTEXT_MESSAGE))
+            else:
+                outcomes.append((retrieved_chunks, None))
+        return outcomes
+
+    def get_answer(self, query: str, subject: str) -> Optional[str]:
+        """Retrieves relevant chunks and synthesizes a final answer using an LLM."""
+        retrieved_chunks, message = self.retrieve_chunks(query, subject)
         if retrieved_chunks is None:
-            logger.error(f"Chunk retrieval failed for subject {subject}.")
-            # Provide a more specific error if possible, otherwise generic
-            return "Error: Failed to retrieve information from the knowledge base. Check logs."
+            return message
+        return self.synthesize(query, subject, retrieved_chunks)
 
-        if not retrieved_chunks:
-            logger.warning("No relevant chunks found by retrieval process.")
-            # Return a user-friendly message indicating nothing was found
-            return "Sorry, I couldn't find relevant information for your query in the knowledge base."
+    def get_answers(self, queries: List[str], subject: str) -> List[Optional[str]]:
+        """
+        Answers several queries, retrieving their chunks in one batch; each
+        answer is then synthesized in turn.
+        """
+        answers = []
+        for query, (retrieved_chunks, message) in zip(queries, self.retrieve_chunks_batch(queries, subject)):
+            if retrieved_chunks is None:
+                answers.append(message)
+            else:
+                answers.append(self.synthesize(
+                    query, subject, retrieved_chunks))
+        return answers
+
+    def find_semantic_answer(self, query: str, subject: str, retrieved_chunks: List[Dict[str, Any]]) -> Optional[str]:
+        """Returns the answer to an earlier, near-identical query over the same chunks."""
+        if not SEMANTIC_CACHE:
+            return None
+        query_embedding = self.get_normalized_query_embedding(query)
+        chunk_keys = semantic_chunk_keys(retrieved_chunks)
+        with self.cache_lock:
+            candidates = [(key, entry) for key, entry in self.semantic_answers.items()
+                          if key[0] == subject and entry[1] == chunk_keys]
+        if not candidates:
+            return None
+        similarities = np.stack(
+            [entry[0] for _, entry in candidates]) @ query_embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < SEMANTIC_CACHE_THRESHOLD:
+            return None
+        key, entry = candidates[best]
+        logger.info(
+            f"Reusing the answer to '{key[1]}' (similarity {similarities[best]:.3f}).")
+        with self.cache_lock:
+            if key in self.semantic_answers:
+                self.semantic_answers.move_to_end(key)
+        return entry[2]
+
+    def remember_semantic_answer(self, query: str, subject: str, retrieved_chunks: List[Dict[str, Any]], answer: str):
+        """Stores an answer for find_semantic_answer."""
+        if not SEMANTIC_CACHE:
+            return
+        entry = (self.get_normalized_query_embedding(query),
+                 semantic_chunk_keys(retrieved_chunks), answer)
+        key = (subject, query.lower().strip())
+        with self.cache_lock:
+            self.semantic_answers[key] = entry
+            self.semantic_answers.move_to_end(key)
+            if len(self.semantic_answers) > SEMANTIC_CACHE_SIZE:
+                self.semantic_answers.popitem(last=False)
+
+    def get_normalized_query_embedding(self, query: str) -> np.ndarray:
+        """The query's cached embedding as a unit-length vector."""
+        embedding = self.get_query_embedding(query.lower().strip())[0]
+        return embedding / np.linalg.norm(embedding)
+
+    def synthesize(self, query: str, subject: str, retrieved_chunks: List[Dict[str, Any]]) -> Optional[str]:
+        """Synthesizes the final answer to a query from its retrieved chunks."""
+        cached_answer = self.find_semantic_answer(
+            query, subject, retrieved_chunks)
+        if cached_answer is not None:
+            return cached_answer
 
         # 2. Synthesize the answer using the LLM
         logger.info(
@@ -170,4 +485,44 @@ class EduQueryCore:
             return synthesized_answer
 
         logger.info("Synthesis successful.")
+        self.remember_semantic_answer(
+            query, subject, retrieved_chunks, synthesized_answer)
         return synthesized_answer
+
+    async def aget_answer(self, query: str, subject: str) -> Optional[str]:
+        """get_answer for async callers; runs in a worker thread."""
+        return await asyncio.to_thread(self.get_answer, query, subject)
+
+    async def aget_answers(self, queries: List[str], subject: str) -> List[Optional[str]]:
+        """Answers several queries concurrently, at most ANSWER_CONCURRENCY at a time."""
+        semaphore = asyncio.Semaphore(ANSWER_CONCURRENCY)
+
+        async def answer(query: str) -> Optional[str]:
+            async with semaphore:
+                return await self.aget_answer(query, subject)
+
+        return await asyncio.gather(*(answer(query) for query in queries))
+
+    def get_answer_stream(self, query: str, subject: str) -> Iterator[str]:
+        """Like get_answer, but yields the answer in pieces as it is generated."""
+        retrieved_chunks, message = self.retrieve_chunks(query, subject)
+        if retrieved_chunks is None:
+            yield message
+            return
+
+        cached_answer = self.find_semantic_answer(
+            query, subject, retrieved_chunks)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+
+        logger.info(
+            f"Streaming answer from {len(retrieved_chunks)} retrieved chunks.")
+        pieces = []
+        for piece in synthesize_answer_stream(query, retrieved_chunks):
+            pieces.append(piece)
+            yield piece
+        answer = "".join(pieces)
+        if answer and "Error:" not in answer:
+            self.remember_semantic_answer(
+                query, subject, retrieved_chunks, answer)
@@ -1,48 +1,64 @@
 import re
-import nltk
-from nltk.tokenize import sent_tokenize
 import logging
+from functools import lru_cache
 from typing import List
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    nltk.download('punkt')
-
 logger = logging.getLogger(__name__)
 
+# Sentence boundary: whitespace after ., ! or ? that is followed by the start
+# of a new sentence, excluding common abbreviations such as "Dr.", "e.g.",
+# "i.e." and single initials. A following digit does not count, so
+# references like "Fig. 3", "Eq. 2" and "No. 5" stay together.
+SENTENCE_BOUNDARY_PATTERN = (
+    r'(?<=[.!?])'
+    r'(?<!\b[A-Z][a-z]\.)(?<!\b[A-Z]\.)(?<!\be\.g\.)(?<!\bi\.e\.)(?<!\betc\.)'
+    r'\s+(?=["\'(\[]?[A-Z])'
+)
+
+# Cleaning patterns, compiled once at import
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+URL_RE = re.compile(r'\s*(https?://\S+|www\.\S+)', re.IGNORECASE)
+BULLET_RE = re.compile(r'•|\uf071|◉')
+HYPHENATED_BREAK_RE = re.compile(r'-\n(\s)*')
+EXCESS_NEWLINES_RE = re.compile(r"\n{3,}")
+EXCESS_SPACES_RE = re.compile(r" {2,}")
+EM_DASH_RE = re.compile(r"—")
+
 
 def remove_html_tags(text):
     """Removes HTML tags from the text."""
-    pattern = re.compile(r'<[^>]+>', re.MULTILINE)
-    return pattern.sub(r'', text)
+    return HTML_TAG_RE.sub(r'', text)
 
 
 def remove_url(text):
     """Removes URLs, including those with leading spaces or line breaks."""
-    pattern = re.compile(r'\s*(https?://\S+|www\.\S+)', re.IGNORECASE)
-    return pattern.sub(r'', text)
+    # The pattern starts with \s*, so it is tried at every whitespace
+    # character; most documents have no URLs, so check for that first.
+    lowered = text.lower()
+    if "http" not in lowered and "www." not in lowered:
+        return text
+    return URL_RE.sub(r'', text)
 
 
 def normalize_bullet_points(text):
     """Replaces different bullet points with a standard '-' format."""
-    text = re.sub(r'•|\uf071|◉', '- ', text)
+    text = BULLET_RE.sub('- ', text)
     # text = re.sub(r'^\s*(\d+\.|[a-z]\))\s+', '- ', text, flags=re.MULTILINE)
     return text
 
 
 def fix_hyphenated_words(text):
     """Fixes words that are broken across lines with hyphens."""
-    return re.sub(r'-\n(\s)*', '', text)
+    return HYPHENATED_BREAK_RE.sub('', text)
 
 
 def clean_text(text):
     """Removes unwanted spaces, newlines, and less critical characters."""
-    text = re.sub(r"\n{3,}", "\n\n",
-                  text)  # Reducing multiple newlines to max two
-    text = re.sub(r" {2,}", " ", text)  # Removing extra spaces
-    text = re.sub(r"—", " - ", text)  # Replacing em-dash
+    text = EXCESS_NEWLINES_RE.sub("\n\n",
+                                  text)  # Reducing multiple newlines to max two
+    text = EXCESS_SPACES_RE.sub(" ", text)  # Removing extra spaces
+    text = EM_DASH_RE.sub(" - ", text)  # Replacing em-dash
     return text.strip()
 
 
@@ -60,6 +76,21 @@ def preprocess_text(text):
     return text
 
 
+@lru_cache(maxsize=None)
+def get_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """Returns a splitter for these settings, built once per process."""
+    separators = ["\n\n", "\n", SENTENCE_BOUNDARY_PATTERN, ", ", " ", ""]
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=separators,
+        is_separator_regex=True,
+        add_start_index=False,
+    )
+
+
 def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
     """
     Splits text into chunks using Langchain's RecursiveCharacterTextSplitter.
@@ -77,16 +108,7 @@ def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> L
             "Invalid input text to chunk_text, returning empty list.")
         return []
 
-
-    separators = ["\n\n", "\n", ". ", "? ", "! ", ", ", " ", ""]
-
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-        separators=separators,
-        add_start_index=False,
-    )
+    text_splitter = get_text_splitter(chunk_size, chunk_overlap)
 
     try:
         chunks = text_splitter.split_text(text)
@@ -1,15 +1,125 @@
 import os
-import json
+import hashlib
+import multiprocessing
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import Executor, ProcessPoolExecutor
+import orjson
 import faiss
 import numpy as np
-from rank_bm25 import BM25Okapi
 import logging
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple, Iterator, Sequence
 from .text_extraction import extract_text_from_pdf, extract_text_from_docx, extract_text_from_ppt
 from .simple_preprocess import chunk_text
+from .bm25 import SparseBM25
 
 logger = logging.getLogger(__name__)
 
+# Number of chunks per forward pass when building a knowledge base
+ENCODE_BATCH_SIZE = 64
+# Number of chunks collected before they are handed to the encoder
+ENCODE_BLOCK_SIZE = 1024
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.docx', '.pptx', '.ppt')
+
+# Worker processes used to extract documents in parallel
+EXTRACTION_WORKERS = os.cpu_count() or 1
+
+# Subjects may be built from several threads; the model's tokenizer is not
+# safe to call concurrently, and one encode already uses every core.
+_ENCODE_LOCK = threading.Lock()
+
+# Per-document embedding cache, stored under the indices folder. Bump the
+# version whenever extraction, chunking or the cache file layout changes.
+EMBEDDING_CACHE_DIRNAME = ".embedding_cache"
+EMBEDDING_CACHE_VERSION = 3
+# Size the cache is trimmed back to after each build, dropping the least
+# recently used documents first
+EMBEDDING_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Content hashes of documents already read, keyed by (absolute path, size,
+# mtime), so rebuilding a subject only re-reads documents that changed
+_FILE_HASHES: Dict[Tuple[str, int, int], str] = {}
+_FILE_HASHES_LOCK = threading.Lock()
+
+# Corpus sizes from which an HNSW graph, and then an IVF index, is built
+# instead of an exact flat index
+HNSW_MIN_VECTORS = 10_000
+IVF_MIN_VECTORS = 100_000
+# Number of IVF lists scanned per query
+IVF_NPROBE = 16
+# HNSW candidate list sizes while building the graph and while searching it;
+# larger values trade speed for recall
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# Maximum number of vectors the index is trained on
+INDEX_TRAIN_SAMPLE = 100_000
+
+# Loaded knowledge bases, keyed by subject indices folder, so that the FAISS
+# index, chunks and BM25 model are read once per process instead of per query.
+# Each entry keeps the mtime of chunks.json, which is written last by a build,
+# so a knowledge base rebuilt by another process is reloaded.
+# Least recently used subjects are evicted beyond KB_CACHE_SIZE.
+KB_CACHE_SIZE = 8
+_KB_CACHE: "OrderedDict[str, Tuple[int, Tuple[Any, Sequence[str], List[str], SparseBM25]]]" = OrderedDict()
+_KB_CACHE_LOCK = threading.Lock()
+
+
+class ChunkStore:
+    """
+    Read-only access to chunk texts stored as one UTF-8 blob plus an array
+    of byte offsets. Both are memory-mapped, so a query only pages in the
+    chunks it actually returns.
+    """
+
+    def __init__(self, blob_file: str, offsets_file: str):
+        self.offsets = np.load(offsets_file, mmap_mode="r")
+        # np.memmap cannot map an empty file
+        if os.path.getsize(blob_file):
+            self.blob = np.memmap(blob_file, dtype=np.uint8, mode="r")
+        else:
+            self.blob = np.empty(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    @staticmethod
+    def write(chunks: List[str], blob_file: str, offsets_file: str) -> None:
+        """Writes chunks in the blob + offsets layout read by ChunkStore."""
+        encoded = [chunk.encode("utf-8") for chunk in chunks]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(chunk) for chunk in encoded])
+        # Replace rather than overwrite: a loaded ChunkStore may still map
+        # the previous files, and truncating a mapped file faults its readers
+        with open(blob_file + ".tmp", "wb") as f:
+            f.write(b"".join(encoded))
+        with open(offsets_file + ".tmp", "wb") as f:
+            np.save(f, offsets)
+        os.replace(blob_file + ".tmp", blob_file)
+        os.replace(offsets_file + ".tmp", offsets_file)
+
+
+def contains_file(folder: str) -> bool:
+    """Whether a folder or any of its subfolders holds a file, stopping at the first one."""
+    subfolders = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                # Like os.walk, symlinked folders are neither files nor
+                # descended into
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append(entry.path)
+                elif not entry.is_dir():
+                    return True
+    except OSError:
+        # Unreadable folders are skipped, as os.walk does
+        return False
+    return any(contains_file(subfolder) for subfolder in subfolders)
+
 
 def get_available_subjects(data_folder: str) -> List[str]:
     """
@@ -22,19 +132,16 @@ def get_available_subjects(data_folder: str) -> List[str]:
             os.makedirs(data_folder, exist_ok=True)
             return subjects
 
-        for item in os.listdir(data_folder):
-            item_path = os.path.join(data_folder, item)
-            if os.path.isdir(item_path):
-                has_files = False
-                for _, _, files in os.walk(item_path):
-                    if files:
-                        has_files = True
-                        break
-
-                if has_files:
-                    subjects.append(item)
-                else:
-                    logger.info(f"Skipping empty subject folder: {item}")
+        # scandir reports the entry type from the directory listing, so
+        # this needs no per-entry stat call
+        with os.scandir(data_folder) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if contains_file(entry.path):
+                        subjects.append(entry.name)
+                    else:
+                        logger.info(
+                            f"Skipping empty subject folder: {entry.name}")
     except Exception as e:
         logger.error(f"Error discovering subjects: {e}")
 
@@ -56,116 +163,405 @@ def extract_document_text(file_path: str) -> str:
         return ""
 
 
-def process_subject_knowledge_base(data_folder: str, indices_folder: str, subject: str, model) -> bool:
+def tokenize_for_bm25(text: str) -> List[str]:
+    """Tokenize text for BM25; shared by index building and querying."""
+    return text.lower().split()
+
+
+def choose_index_factory(num_vectors: int) -> str:
+    """Pick the faiss.index_factory description for a corpus of this size."""
+    if num_vectors < HNSW_MIN_VECTORS:
+        return "Flat"
+    if num_vectors < IVF_MIN_VECTORS:
+        # The graph links need no compression, but the vectors it visits are
+        # stored as float16, halving the bytes read per distance
+        return "HNSW32,SQfp16"
+    # 8-bit scalar quantization stores a quarter of the float32 bytes, so
+    # scanning the probed lists reads far less memory
+    return f"IVF{int(np.sqrt(num_vectors))},SQ8"
+
+
+def build_faiss_index(embeddings: np.ndarray) -> Tuple[Any, str]:
+    """
+    Build an inner-product FAISS index over L2-normalized embeddings.
+
+    Small corpora use an exact flat index; larger ones use an HNSW graph or
+    a quantized IVF index so that search does not scan every vector.
+    Returns the index together with its factory description.
+    """
+    num_vectors, dimension = embeddings.shape
+    index_type = choose_index_factory(num_vectors)
+    index = faiss.index_factory(
+        dimension, index_type, faiss.METRIC_INNER_PRODUCT)
+    if index_type.startswith("HNSW"):
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+
+    if not index.is_trained:
+        # Training cost grows with the sample while cluster quality levels
+        # off well before that, so train on a random subset
+        training_set = embeddings
+        if num_vectors > INDEX_TRAIN_SAMPLE:
+            rng = np.random.default_rng(0)
+            training_set = embeddings[rng.choice(
+                num_vectors, INDEX_TRAIN_SAMPLE, replace=False)]
+        logger.info(
+            f"Training {index_type} index on {len(training_set)} vectors.")
+        index.train(training_set)
+
+    logger.info(f"Adding {num_vectors} embeddings to {index_type} index.")
+    index.add(embeddings)
+    return index, index_type
+
+
+def iter_subject_documents(subject_folder: str) -> Iterator[Tuple[str, str]]:
+    """Walk a subject folder and yield (relative_path, file_path) of supported documents."""
+    for root, _, files in os.walk(subject_folder):
+        for file in files:
+            file_path = os.path.join(root, file)
+            relative_path = os.path.relpath(file_path, subject_folder)
+
+            if file.startswith('.'):
+                continue
+
+            if not file.lower().endswith(SUPPORTED_EXTENSIONS):
+                logger.warning(f"Unsupported file format: {file}")
+                continue
+
+            yield relative_path, file_path
+
+
+def get_documents_manifest(documents: List[Tuple[str, str]], model_name: str) -> str:
+    """
+    Fingerprint of a subject's documents from their paths, sizes and
+    modification times, plus everything else that shapes the index.
+    """
+    digest = hashlib.sha256(
+        f"{EMBEDDING_CACHE_VERSION}:{model_name}".encode("utf-8"))
+    for relative_path, file_path in sorted(documents):
+        stat = os.stat(file_path)
+        digest.update(
+            f"\0{relative_path}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_built_manifest(chunks_file: str, faiss_index_file: str) -> Optional[str]:
+    """Manifest recorded by the last complete build, if there is one."""
+    if not os.path.exists(chunks_file) or not os.path.exists(faiss_index_file):
+        return None
+    try:
+        with open(chunks_file, "rb") as f:
+            return orjson.loads(f.read()).get("manifest")
+    except Exception as e:
+        logger.warning(f"Could not read {chunks_file}: {e}")
+        return None
+
+
+def extract_document_chunks(file_path: str) -> List[str]:
+    """Extract and chunk the text of a single document."""
+    text = extract_document_text(file_path)
+    if not text:
+        return []
+    return chunk_text(text)
+
+
+def get_file_hash(file_path: str) -> str:
+    """
+    SHA-256 of a file's content, reading the file only when its path, size
+    or modification time is new to this process.
+    """
+    stat = os.stat(file_path)
+    stat_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    with _FILE_HASHES_LOCK:
+        file_hash = _FILE_HASHES.get(stat_key)
+    if file_hash is not None:
+        return file_hash
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    file_hash = digest.hexdigest()
+    with _FILE_HASHES_LOCK:
+        _FILE_HASHES[stat_key] = file_hash
+    return file_hash
+
+
+def get_embedding_cache_file(cache_folder: str, file_path: str, model_name: str) -> str:
+    """
+    Path of the cached chunks and embeddings for a document, keyed by the
+    document's content and the embedding model.
+    """
+    key = hashlib.sha256(
+        f"{EMBEDDING_CACHE_VERSION}:{model_name}:{get_file_hash(file_path)}".encode()).hexdigest()
+    return os.path.join(cache_folder, f"{key}.npz")
+
+
+def load_cached_embeddings(cache_file: str) -> Optional[Tuple[List[str], np.ndarray]]:
+    """Load cached (chunks, embeddings) for a document, or None on a miss."""
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file, allow_pickle=False) as data:
+            chunk_bytes = data["chunk_bytes"].tobytes()
+            offsets = data["chunk_offsets"].tolist()
+            embeddings = data["embeddings"]
+        chunks = [chunk_bytes[start:end].decode("utf-8")
+                  for start, end in zip(offsets, offsets[1:])]
+        # Marks the entry as recently used for prune_embedding_cache
+        os.utime(cache_file)
+        return chunks, embeddings
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable embedding cache {cache_file}: {e}")
+        return None
+
+
+def save_cached_embeddings(cache_file: str, chunks: List[str], embeddings: np.ndarray) -> None:
+    """Save a document's chunks and embeddings to the embedding cache."""
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Chunks are stored as one UTF-8 blob plus offsets, as in ChunkStore;
+        # a numpy string array pads every chunk to the longest in UTF-32
+        encoded = [chunk.encode("utf-8") for chunk in chunks]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        offsets[1:] = np.cumsum([len(chunk) for chunk in encoded])
+        tmp_file = f"{cache_file}.{threading.get_ident()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(f, chunk_bytes=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+                     chunk_offsets=offsets, embeddings=embeddings)
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        logger.warning(f"Failed to write embedding cache {cache_file}: {e}")
+
+
+def prune_embedding_cache(cache_folder: str) -> None:
+    """
+    Delete the least recently used embedding cache entries until the cache
+    fits in EMBEDDING_CACHE_MAX_BYTES.
+    """
+    try:
+        entries = []
+        with os.scandir(cache_folder) as scanned:
+            for entry in scanned:
+                if entry.name.endswith(".npz"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total_bytes = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total_bytes <= EMBEDDING_CACHE_MAX_BYTES:
+                break
+            os.remove(path)
+            total_bytes -= size
+            removed += 1
+        if removed:
+            logger.info(
+                f"Removed {removed} least recently used entries from the embedding cache")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Failed to prune embedding cache {cache_folder}: {e}")
+
+
+def encode_chunks(chunks: List[str], model) -> np.ndarray:
+    """Encode chunks into L2-normalized float32 embeddings."""
+    logger.info(
+        f"Encoding {len(chunks)} chunks in batches of {ENCODE_BATCH_SIZE}...")
+    # Passing many chunks per call lets sentence-transformers length-sort
+    # them before batching, which minimises padding.
+    with _ENCODE_LOCK:
+        embeddings = model.encode(
+            chunks,
+            batch_size=ENCODE_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+    return embeddings.astype('float32')
+
+
+def create_extraction_executor(num_documents: int) -> Executor:
+    """
+    Executor for document extraction: a process pool when several documents
+    need extracting (PDF parsing and OCR are CPU-bound), otherwise inline.
+    """
+    if num_documents <= 1:
+        return InlineExecutor()
+    # spawn rather than fork: the parent may already run torch/OpenMP threads
+    return ProcessPoolExecutor(
+        max_workers=min(EXTRACTION_WORKERS, num_documents),
+        mp_context=multiprocessing.get_context("spawn"))
+
+
+class InlineExecutor(Executor):
+    """Executor that runs map() lazily in the calling thread."""
+
+    def map(self, fn, *iterables, timeout=None, chunksize=1):
+        return map(fn, *iterables)
+
+
+def encode_pending_documents(pending_documents: List[Tuple[int, List[str], str]], document_embeddings: List[Optional[np.ndarray]], model) -> None:
+    """
+    Encode the chunks of all pending documents in one call, store each
+    document's slice of embeddings at its position and in the cache.
+    """
+    embeddings = encode_chunks(
+        [chunk for _, doc_chunks, _ in pending_documents for chunk in doc_chunks], model)
+    offset = 0
+    for position, doc_chunks, cache_file in pending_documents:
+        doc_embeddings = embeddings[offset:offset + len(doc_chunks)]
+        document_embeddings[position] = doc_embeddings
+        save_cached_embeddings(cache_file, doc_chunks, doc_embeddings)
+        offset += len(doc_chunks)
+    pending_documents.clear()
+
+
+def process_subject_knowledge_base(data_folder: str, indices_folder: str, subject: str, model, model_name: str = "", executor: Optional[Executor] = None) -> bool:
     """
     Process all document files for a specific subject and build knowledge base.
+
+    Chunks and embeddings of each document are cached by content hash, so
+    unchanged documents are neither re-extracted nor re-encoded. Documents
+    are extracted on the given executor, or on one created for this subject.
     """
     subject_folder = os.path.join(
         data_folder, subject)
     subject_indices_folder = os.path.join(indices_folder, subject)
+    cache_folder = os.path.join(indices_folder, EMBEDDING_CACHE_DIRNAME)
 
     os.makedirs(subject_indices_folder, exist_ok=True)
 
     faiss_index_file = os.path.join(subject_indices_folder, "faiss_index.idx")
+    index_meta_file = os.path.join(subject_indices_folder, "index_meta.json")
     chunks_file = os.path.join(subject_indices_folder, "chunks.json")
-    bm25_file = os.path.join(subject_indices_folder, "bm25.json")
-
-    chunks = []
-    sources = []
+    chunks_blob_file = os.path.join(subject_indices_folder, "chunks.bin")
+    chunk_offsets_file = os.path.join(
+        subject_indices_folder, "chunk_offsets.npy")
+    bm25_weights_file = os.path.join(subject_indices_folder, "bm25.npz")
+    bm25_vocabulary_file = os.path.join(
+        subject_indices_folder, "bm25_vocab.json")
+
+    chunks: List[str] = []
+    sources: List[str] = []
+    # Embeddings per document, in document order; None until encoded
+    document_embeddings: List[Optional[np.ndarray]] = []
+    # (document position, chunks, cache file) of documents awaiting encoding
+    pending_documents: List[Tuple[int, List[str], str]] = []
+    pending_chunk_count = 0
 
     try:
-        for root, _, files in os.walk(subject_folder):
-            for file in files:
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, subject_folder)
-
-                if file.startswith('.'):
-                    continue
-
+        documents = list(iter_subject_documents(subject_folder))
+
+        # Nothing to do when no document was added, removed or modified
+        # since the last complete build
+        manifest = get_documents_manifest(documents, model_name)
+        if manifest == read_built_manifest(chunks_file, faiss_index_file):
+            logger.info(
+                f"Knowledge base for {subject} is up to date, skipping rebuild")
+            return True
+
+        cache_files = [get_embedding_cache_file(cache_folder, file_path, model_name)
+                       for _, file_path in documents]
+        cached_entries = [load_cached_embeddings(cache_file)
+                          for cache_file in cache_files]
+        uncached_paths = [file_path for (_, file_path), cached in zip(documents, cached_entries)
+                          if cached is None]
+
+        if executor is None:
+            extraction_context = create_extraction_executor(
+                len(uncached_paths))
+        else:
+            extraction_context = nullcontext(executor)
+
+        with extraction_context as extraction_executor:
+            # Results come back in document order as soon as each is ready,
+            # so encoding starts while later documents are still extracted.
+            extracted_chunks = extraction_executor.map(
+                extract_document_chunks, uncached_paths)
+
+            for (relative_path, _), cache_file, cached in zip(documents, cache_files, cached_entries):
                 logger.info(f"Processing file: {relative_path}")
-
-                # Extracting text based on file type
-                if file.lower().endswith('.pdf'):
-                    text = extract_text_from_pdf(file_path)
-                elif file.lower().endswith('.docx'):
-                    text = extract_text_from_docx(file_path)
-                elif file.lower().endswith(('.pptx', '.ppt')):
-                    text = extract_text_from_ppt(file_path)
+                if cached is not None:
+                    text_chunks, embeddings = cached
+                    logger.info(
+                        f"Using cached embeddings for {relative_path}")
                 else:
-                    logger.warning(f"Unsupported file format: {file}")
-                    continue
+                    text_chunks = next(extracted_chunks)
+                    embeddings = None
 
-                if not text:
+                if not text_chunks:
                     logger.warning(f"No text extracted from {relative_path}")
                     continue
 
-                text_chunks = chunk_text(text)
-
-                if text_chunks:
-                    chunks.extend(text_chunks)
-                    sources.extend([relative_path] * len(text_chunks))
+                position = len(document_embeddings)
+                document_embeddings.append(embeddings)
+                chunks.extend(text_chunks)
+                sources.extend([relative_path] * len(text_chunks))
+
+                if embeddings is None:
+                    pending_documents.append((position, text_chunks, cache_file))
+                    pending_chunk_count += len(text_chunks)
+                    # Encode in rolling blocks as documents arrive instead of
+                    # buffering the whole subject first.
+                    if pending_chunk_count >= ENCODE_BLOCK_SIZE:
+                        encode_pending_documents(
+                            pending_documents, document_embeddings, model)
+                        pending_chunk_count = 0
 
         if not chunks:
             logger.warning(f"No content extracted for subject: {subject}")
             return False
 
-        # Adjusting batch size based on GPU memory
-        batch_size = 8
-        all_embeddings = []
-        logger.info(
-            f"Encoding {len(chunks)} chunks in batches of {batch_size}...")
-        for i in range(0, len(chunks), batch_size):
-            batch_chunks = chunks[i:i+batch_size]
-            try:
-                # Ensure model is on the correct device (redundant if loaded correctly, but safe)
-                # device = next(model.parameters()).device
-                # batch_embeddings = model.encode(batch_chunks, device=device)
-                batch_embeddings = model.encode(batch_chunks)
-                all_embeddings.append(batch_embeddings)
-                logger.debug(
-                    f"Encoded batch {i//batch_size + 1}/{(len(chunks) + batch_size - 1)//batch_size}")
-            except Exception as batch_e:
-                logger.error(
-                    f"Error encoding batch starting at index {i}: {batch_e}")
-
-                raise batch_e
-
-        if not all_embeddings:
-            logger.error(
-                "No embeddings were generated, possibly due to errors in all batches.")
-            return False
-
-        embeddings = np.concatenate(all_embeddings, axis=0)
+        if pending_documents:
+            encode_pending_documents(
+                pending_documents, document_embeddings, model)
 
-        embeddings = embeddings.astype('float32')
+        embeddings = np.concatenate(document_embeddings, axis=0)
 
-        # Create FAISS index with proper dimensionality
-        dimension = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dimension)
+        index, index_type = build_faiss_index(embeddings)
+        logger.info("Embeddings added successfully.")
 
-        logger.info(f"Adding {len(embeddings)} embeddings to FAISS index.")
+        # The artifacts below are replaced one by one; without chunks.json
+        # the knowledge base counts as incomplete until all are written, so
+        # an interrupted rebuild never leaves new files next to old sources.
+        if os.path.exists(chunks_file):
+            os.remove(chunks_file)
+
+        # IVF indices are memory-mapped by readers; replacing the file rather
+        # than truncating it keeps their old mapping valid instead of SIGBUS
+        faiss.write_index(index, faiss_index_file + ".tmp")
+        os.replace(faiss_index_file + ".tmp", faiss_index_file)
+        index_meta: Dict[str, Any] = {"type": index_type}
+        if index_type.startswith("IVF"):
+            index_meta["nprobe"] = IVF_NPROBE
+        elif index_type.startswith("HNSW"):
+            index_meta["ef_search"] = HNSW_EF_SEARCH
+        with open(index_meta_file, "wb") as f:
+            f.write(orjson.dumps(index_meta))
+
+        ChunkStore.write(chunks, chunks_blob_file, chunk_offsets_file)
 
-        index.add(embeddings)
-        logger.info("Embeddings added successfully.")
+        # BM25 index
+        tokenized_corpus = [tokenize_for_bm25(chunk) for chunk in chunks]
+        bm25 = SparseBM25(tokenized_corpus)
 
-        faiss.write_index(index, faiss_index_file)
+        bm25.save(bm25_weights_file, bm25_vocabulary_file)
 
-        # Save chunks and metadata
-        with open(chunks_file, "w") as f:
-            json.dump({
-                "chunks": chunks,
-                "sources": sources
-            }, f)
+        # Save chunk metadata last: check_subject_index treats its presence
+        # as a complete knowledge base, so an interrupted build is rebuilt.
+        # The manifest is kept here rather than in index_meta.json for the
+        # same reason: it must only describe a finished build.
+        with open(chunks_file + ".tmp", "wb") as f:
+            f.write(orjson.dumps({
+                "sources": sources,
+                "manifest": manifest
+            }))
+        os.replace(chunks_file + ".tmp", chunks_file)
 
-        # BM25 index
-        tokenized_corpus = [chunk.split(" ") for chunk in chunks]
-        bm25 = BM25Okapi(tokenized_corpus)
+        # Drop any stale in-memory copy of this knowledge base
+        with _KB_CACHE_LOCK:
+            _KB_CACHE.pop(subject_indices_folder, None)
 
-        with open(bm25_file, "w") as f:
-            json.dump({
-                "chunks": chunks,
-                "sources": sources
-            }, f)
+        prune_embedding_cache(cache_folder)
 
         logger.info(
             f"Successfully created knowledge base for {subject} with {len(chunks)} chunks")
@@ -178,81 +574,201 @@ def process_subject_knowledge_base(data_folder: str, indices_folder: str, subjec
         return False
 
 
-def calculate_relevance(chunk: str, query: str, model) -> float:
-    """Calculate semantic relevance between chunk and query"""
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without sorting every score."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(-scores[top])]
+
+
+def calculate_relevances(chunks: List[str], query_embedding: np.ndarray, model) -> np.ndarray:
+    """
+    Cosine similarity of each chunk to an already encoded query. The chunks
+    are encoded together in one call rather than one forward pass each.
+    """
     try:
-        chunk_embedding = model.encode([chunk], convert_to_numpy=True)[0]
-        query_embedding = model.encode([query], convert_to_numpy=True)[0]
-        similarity = np.dot(chunk_embedding, query_embedding) / (
-            np.linalg.norm(chunk_embedding) * np.linalg.norm(query_embedding)
-        )
-        return float(similarity)
+        with _ENCODE_LOCK:
+            chunk_embeddings = model.encode(
+                chunks, batch_size=ENCODE_BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+        query_embedding = np.asarray(query_embedding, dtype='float32').ravel()
+        return chunk_embeddings @ (query_embedding / np.linalg.norm(query_embedding))
     except Exception:
-        return 0.5
+        return np.full(len(chunks), 0.5)
+
+
+def load_subject_knowledge_base(subject_indices_folder: str) -> Tuple[Any, Sequence[str], List[str], SparseBM25]:
+    """
+    Load the FAISS index, chunks, sources and BM25 model for a subject,
+    reusing the in-memory copy when it has already been loaded.
+    """
+    chunks_file = os.path.join(subject_indices_folder, "chunks.json")
+    mtime = os.stat(chunks_file).st_mtime_ns
+    with _KB_CACHE_LOCK:
+        cached = _KB_CACHE.get(subject_indices_folder)
+        if cached is not None and cached[0] == mtime:
+            _KB_CACHE.move_to_end(subject_indices_folder)
+            return cached[1]
+
+    faiss_index_file = os.path.join(subject_indices_folder, "faiss_index.idx")
+    index_meta_file = os.path.join(subject_indices_folder, "index_meta.json")
+    chunks_blob_file = os.path.join(subject_indices_folder, "chunks.bin")
+    chunk_offsets_file = os.path.join(
+        subject_indices_folder, "chunk_offsets.npy")
+    bm25_weights_file = os.path.join(subject_indices_folder, "bm25.npz")
+    bm25_vocabulary_file = os.path.join(
+        subject_indices_folder, "bm25_vocab.json")
+
+    logger.info(f"Loading knowledge base from {subject_indices_folder}")
+    with open(chunks_file, "rb") as f:
+        data = orjson.loads(f.read())
+    if "chunks" in data:
+        # Knowledge bases that stored the chunk texts inline
+        text_chunks = data["chunks"]
+    else:
+        text_chunks = ChunkStore(chunks_blob_file, chunk_offsets_file)
+    sources = data.get("sources", ["unknown"] * len(text_chunks))
+
+    index_meta: Dict[str, Any] = {}
+    if os.path.exists(index_meta_file):
+        with open(index_meta_file, "rb") as f:
+            index_meta = orjson.loads(f.read())
+
+    if index_meta.get("type", "").startswith("IVF"):
+        # IVF inverted lists can be memory-mapped, so only the lists that
+        # queries actually probe are paged in
+        index = faiss.read_index(
+            faiss_index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    else:
+        index = faiss.read_index(faiss_index_file)
+    index_ivf = faiss.try_extract_index_ivf(index)
+    if index_ivf is not None:
+        index_ivf.nprobe = index_meta.get("nprobe", IVF_NPROBE)
+    elif index_meta.get("type", "").startswith("HNSW"):
+        index.hnsw.efSearch = index_meta.get("ef_search", HNSW_EF_SEARCH)
+
+    if os.path.exists(bm25_weights_file) and os.path.exists(bm25_vocabulary_file):
+        bm25 = SparseBM25.load(bm25_weights_file, bm25_vocabulary_file)
+    else:
+        # Knowledge bases built before the BM25 index was persisted
+        tokenized_corpus = [tokenize_for_bm25(chunk) for chunk in text_chunks]
+        bm25 = SparseBM25(tokenized_corpus)
+
+    kb = (index, text_chunks, sources, bm25)
+    with _KB_CACHE_LOCK:
+        _KB_CACHE[subject_indices_folder] = (mtime, kb)
+        _KB_CACHE.move_to_end(subject_indices_folder)
+        if len(_KB_CACHE) > KB_CACHE_SIZE:
+            evicted, _ = _KB_CACHE.popitem(last=False)
+            logger.info(f"Evicted knowledge base {evicted} from memory")
+    return kb
+
 
+def encode_query(query: str, model) -> np.ndarray:
+    """Encodes a query into a (1, dim) float32 embedding."""
+    return encode_queries([query], model)
 
-def get_answer_for_subject(query: str, subject: str, indices_folder: str, model) -> Optional[List[Dict[str, Any]]]:
-    """Get answer for a specific subject, returning structured results."""
+
+def encode_queries(queries: List[str], model) -> np.ndarray:
+    """Encodes queries into an (n, dim) float32 matrix in one call."""
+    with _ENCODE_LOCK:
+        embeddings = model.encode(queries, convert_to_numpy=True)
+    return embeddings.astype('float32')
+
+
+def rank_candidates(query: str, query_embedding: np.ndarray, faiss_idx: np.ndarray, faiss_scores: Optional[np.ndarray], text_chunks: Sequence[str], sources: List[str], bm25: SparseBM25, model, k_initial: int) -> List[Dict[str, Any]]:
+    """
+    Merge one query's FAISS and BM25 candidates and rerank them.
+
+    faiss_scores, when given, are the cosine similarities FAISS returned for
+    faiss_idx; only candidates found by BM25 alone are encoded then.
+    """
+    # BM25 retrieval
+    bm25_scores = bm25.get_scores(tokenize_for_bm25(query))
+
+    bm25_top_idx = top_k_indices(bm25_scores, k_initial)
+
+    relevance_by_idx: Dict[int, float] = {}
+    if faiss_scores is not None:
+        relevance_by_idx = {idx: float(score) for idx, score in zip(
+            faiss_idx.tolist(), faiss_scores.tolist()) if 0 <= idx < len(text_chunks)}
+    all_idx = list(set(faiss_idx.tolist() + bm25_top_idx.tolist()))
+
+    # Re-ranking
+    unscored_idx = [idx for idx in all_idx
+                    if 0 <= idx < len(text_chunks) and idx not in relevance_by_idx]
+    if unscored_idx:
+        relevance_scores = calculate_relevances(
+            [text_chunks[idx] for idx in unscored_idx], query_embedding, model)
+        relevance_by_idx.update(
+            zip(unscored_idx, map(float, relevance_scores)))
+    scored_results_data = [{
+        "id": f"chunk_{idx}",
+        "text": text_chunks[idx],
+        "source": sources[idx],
+        "score": relevance_score
+    } for idx, relevance_score in relevance_by_idx.items()]
+
+    # Sorting by relevance score
+    scored_results_data.sort(key=lambda x: x["score"], reverse=True)
+
+    return scored_results_data[:5]
+
+
+def get_answers_for_subject(queries: List[str], subject: str, indices_folder: str, model, query_embeddings: Optional[np.ndarray] = None) -> Optional[List[Optional[List[Dict[str, Any]]]]]:
+    """
+    Retrieve results for several queries at once: the queries are encoded
+    in one call (unless query_embeddings is given) and searched with a
+    single FAISS call. Returns one result list (or None) per query.
+    """
     subject_indices_folder = os.path.join(indices_folder, subject)
     faiss_index_file = os.path.join(subject_indices_folder, "faiss_index.idx")
     chunks_file = os.path.join(subject_indices_folder, "chunks.json")
-    bm25_file = os.path.join(subject_indices_folder, "bm25.json")
 
     if not os.path.exists(faiss_index_file) or not os.path.exists(chunks_file):
         logger.error(f"Knowledge base for {subject} not found")
         return None
 
     try:
-        with open(chunks_file, "r") as f:
-            data = json.load(f)
-            text_chunks = data["chunks"]
-            sources = data.get("sources", ["unknown"] * len(text_chunks))
-
-        # FAISS retrieval
-        query_embedding = model.encode([query], convert_to_numpy=True)
-        index = faiss.read_index(faiss_index_file)
+        index, text_chunks, sources, bm25 = load_subject_knowledge_base(
+            subject_indices_folder)
+
+        # FAISS retrieval; copy supplied embeddings since normalize_L2
+        # works in place
+        if query_embeddings is None:
+            query_embeddings = encode_queries(queries, model)
+        else:
+            query_embeddings = np.array(query_embeddings, dtype='float32')
+        inner_product = index.metric_type == faiss.METRIC_INNER_PRODUCT
+        if inner_product:
+            faiss.normalize_L2(query_embeddings)
 
         k_initial = 5
-        D, faiss_idx = index.search(query_embedding.astype(
-            'float32'), k_initial)
-
-        # BM25 retrieval
-        all_idx = faiss_idx[0].tolist()
-        if os.path.exists(bm25_file):
-            with open(bm25_file, "r") as f:
-                bm25_data = json.load(f)
-            tokenized_corpus = [chunk.split(" ") for chunk in text_chunks]
-            bm25 = BM25Okapi(tokenized_corpus)
-            bm25_scores = bm25.get_scores(query.split(" "))
-
-            bm25_top_idx = np.argsort(bm25_scores)[-k_initial:][::-1]
-
-            all_idx = list(set(all_idx + bm25_top_idx.tolist()))
-
-        # Re-ranking
-        scored_results_data = []
-        for idx in all_idx:
-            if 0 <= idx < len(text_chunks):
-                chunk = text_chunks[idx]
-                source = sources[idx]
-                relevance_score = calculate_relevance(
-                    chunk, query, model)
-                scored_results_data.append({
-                    "id": f"chunk_{idx}",
-                    "text": chunk,
-                    "source": source,
-                    "score": relevance_score
-                })
-
-        # Sorting by relevance score
-        scored_results_data.sort(key=lambda x: x["score"], reverse=True)
-
-        final_results = scored_results_data[:5]
-
-        return final_results if final_results else None
+        D, faiss_idx = index.search(query_embeddings, k_initial)
+
+        results = []
+        for query, query_embedding, query_faiss_idx, query_D in zip(queries, query_embeddings, faiss_idx, D):
+            # Inner products of normalized vectors are already the cosine
+            # similarities the reranker computes; older L2 indices are rescored
+            final_results = rank_candidates(
+                query, query_embedding, query_faiss_idx, query_D if inner_product else None,
+                text_chunks, sources, bm25, model, k_initial)
+            results.append(final_results if final_results else None)
+        return results
 
     except Exception as e:
         logger.error(f"Error retrieving answer for {subject}: {e}")
         import traceback
         logger.error(traceback.format_exc())
         return None
+
+
+def get_answer_for_subject(query: str, subject: str, indices_folder: str, model, query_embedding: Optional[np.ndarray] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Get answer for a specific subject, returning structured results.
+    A precomputed query_embedding (from encode_query) skips re-encoding.
+    """
+    results = get_answers_for_subject(
+        [query], subject, indices_folder, model, query_embeddings=query_embedding)
+    return results[0] if results is not None else None
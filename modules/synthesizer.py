@@ -1,9 +1,15 @@
 # --- Keep necessary imports ---
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Iterator, Tuple
 import os
+import re
+import hashlib
 import logging
 import traceback
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from functools import lru_cache
+from collections import OrderedDict
+from threading import Lock, Thread
+import torch
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, TextIteratorStreamer
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +17,28 @@ logger = logging.getLogger(__name__)
 DEFAULT_SYNTHESIS_MODEL_PATH = "models/flan-t5-base"
 SYNTHESIS_MODEL_PATH = os.getenv(
     "SYNTHESIS_MODEL_PATH", DEFAULT_SYNTHESIS_MODEL_PATH)
+# Set to "1" to run the synthesis model's linear layers with int8 weights
+# (torch dynamic quantization): faster CPU generation, slightly different text
+SYNTHESIS_QUANTIZE = os.getenv("SYNTHESIS_QUANTIZE", "0") == "1"
+# Set to "1" to compile the model's forward pass with torch.compile. The
+# first answers are slow while graphs compile; later ones run faster.
+SYNTHESIS_COMPILE = os.getenv("SYNTHESIS_COMPILE", "0") == "1"
+
+# Upper bound on generated answer tokens
+MAX_NEW_TOKENS = 400
+# Beams for synthesize_answer_with_llm; 1 decodes greedily, which costs a
+# quarter of the decoder work of 4 beams
+SYNTHESIS_NUM_BEAMS = int(os.getenv("SYNTHESIS_NUM_BEAMS", "1"))
+
+# Number of recent answers kept, keyed by the prompt they were generated
+# from, so a repeated question over the same chunks skips generation
+ANSWER_CACHE_SIZE = 256
+_ANSWER_CACHE: "OrderedDict[Tuple[str, bytes], str]" = OrderedDict()
+_ANSWER_CACHE_LOCK = Lock()
+
+# The model is shared by every caller, and neither generate() nor a compiled
+# forward is safe to run from several threads at once
+_GENERATE_LOCK = Lock()
 
 local_tokenizer = None
 local_model = None
@@ -30,6 +58,16 @@ else:
         logger.info(f"Forcing device: {device}")
         local_model = AutoModelForSeq2SeqLM.from_pretrained(
             SYNTHESIS_MODEL_PATH).to(device)
+        if SYNTHESIS_QUANTIZE:
+            logger.info("Quantizing synthesis model linear layers to int8.")
+            local_model = torch.ao.quantization.quantize_dynamic(
+                local_model, {torch.nn.Linear}, dtype=torch.qint8)
+        if SYNTHESIS_COMPILE:
+            # Compiling forward rather than the module keeps generate() and
+            # its streamer support; input lengths vary, hence dynamic shapes
+            logger.info("Compiling synthesis model forward pass.")
+            local_model.forward = torch.compile(
+                local_model.forward, dynamic=True)
         logger.info("Local model and tokenizer loaded successfully onto CPU.")
     
     except Exception as e:
@@ -37,6 +75,146 @@ else:
             f"Failed to load local model/tokenizer from {SYNTHESIS_MODEL_PATH}: {e}")
 
 
+# Phrases by which the model says the context does not answer the query,
+# including the reply PROMPT_TEMPLATE asks for; matched in one scan
+NO_ANSWER_PHRASES = [
+    "provided context does not have the answer",
+    "does not contain specific information",
+    "insufficient information",
+]
+NO_ANSWER_RE = re.compile(
+    "|".join(re.escape(phrase) for phrase in NO_ANSWER_PHRASES), re.IGNORECASE)
+
+# Tokens the synthesis model reads; longer prompts are truncated at the end,
+# which would cut off the instructions after the context
+MAX_INPUT_TOKENS = 1024
+# Tokens kept free when fitting the context, since tokenizing the pieces
+# separately does not exactly match tokenizing the joined prompt
+CONTEXT_TOKEN_MARGIN = 16
+# Characters of each chunk, and of all chunks together, put into the prompt
+# when no tokenizer is loaded to measure it; a final safeguard otherwise
+MAX_CHUNK_CHARS = 1500
+MAX_CONTEXT_CHARS = 12000
+
+# Synthesis prompt; {query} and {context} are filled in per question
+PROMPT_TEMPLATE = '''You are an AI assistant for the EduQuery college chatbot. Your primary goal is to provide a comprehensive and detailed answer to the user's query based *only* on the provided context paragraphs (labeled Source [1], Source [2], etc.). Do not use any external knowledge or information you might have.
+
+User Query: \\"{query}\\"
+
+Context:
+---
+{context}
+---
+
+Instructions:
+1.  Carefully analyze the User Query and the provided Context paragraphs.
+2.  Synthesize a thorough and elaborate answer to the query using *only* information explicitly stated in the Context. Explain the concepts clearly and provide as much relevant detail as found in the sources.
+3.  If the context contains the answer, formulate it clearly and comprehensively. Cite the source(s) using the format (Source [N]) where the information was found. Combine information from multiple sources if needed, citing all relevant ones, and ensure the synthesized answer flows logically.
+4.  If the context *does not* contain sufficient information relevant to the query to provide a detailed answer, respond with: "The provided context does not contain specific information to answer this query in detail." Do not attempt to guess or infer an answer.
+5.  Structure the answer logically. Use bullet points or numbered lists if it helps clarity for complex information or steps.
+6.  If the context is too long or complex, summarize the key points before synthesizing the answer.
+Answer:
+'''
+
+
+@lru_cache(maxsize=1)
+def count_template_tokens() -> int:
+    """Tokens PROMPT_TEMPLATE takes up without a query or context."""
+    return len(local_tokenizer(PROMPT_TEMPLATE.format(query="", context=""))["input_ids"])
+
+
+@lru_cache(maxsize=1)
+def count_separator_tokens() -> int:
+    """Tokens of the blank line joining two context parts."""
+    return len(local_tokenizer("\n\n", add_special_tokens=False)["input_ids"])
+
+
+def fit_context_to_budget(query: str, chunk_texts: List[str]) -> List[str]:
+    """
+    Labels chunks as "Source [N]" context parts, best first, until the
+    prompt would exceed MAX_INPUT_TOKENS; the last part that fits is cut
+    at a token boundary.
+    """
+    budget = MAX_INPUT_TOKENS - CONTEXT_TOKEN_MARGIN - count_template_tokens() - \
+        len(local_tokenizer(query, add_special_tokens=False)["input_ids"])
+    context_parts = []
+    for i, chunk_text in enumerate(chunk_texts):
+        if context_parts:
+            budget -= count_separator_tokens()
+        part = f"Source [{i+1}]:\n{chunk_text}"
+        token_ids = local_tokenizer(part, add_special_tokens=False)["input_ids"]
+        if len(token_ids) > budget:
+            # A sliver of a chunk is not worth its label
+            if budget >= 32:
+                context_parts.append(local_tokenizer.decode(
+                    token_ids[:budget], skip_special_tokens=True))
+            break
+        context_parts.append(part)
+        budget -= len(token_ids)
+    return context_parts
+
+
+def build_synthesis_prompt(query: str, retrieved_chunks: List[Dict[str, Any]]) -> Tuple[str, Dict[str, str]]:
+    """Builds the LLM prompt and the mapping of source labels to documents."""
+    chunk_texts = [chunk_data.get('text', '') for chunk_data in retrieved_chunks]
+    if local_tokenizer:
+        context_parts = fit_context_to_budget(query, chunk_texts)
+    else:
+        # Slicing copies the string, so only chunks over the limit are cut
+        context_parts = [
+            f"Source [{i+1}]:\n{chunk_text if len(chunk_text) <= MAX_CHUNK_CHARS else chunk_text[:MAX_CHUNK_CHARS]}"
+            for i, chunk_text in enumerate(chunk_texts)]
+    # Only chunks that made it into the context are listed as sources
+    source_mapping = {f"Source [{i+1}]": chunk_data.get('source', 'Unknown')
+                      for i, chunk_data in enumerate(retrieved_chunks[:len(context_parts)])}
+    context_string = "\n\n".join(context_parts)
+
+    if len(context_string) > MAX_CONTEXT_CHARS:
+        context_string = context_string[:MAX_CONTEXT_CHARS] + \
+            "\n... [Context Truncated]"
+        logger.warning("Context string truncated due to length limit.")
+
+    prompt = PROMPT_TEMPLATE.format(query=query, context=context_string)
+    return prompt, source_mapping
+
+
+def answer_cache_key(mode: str, prompt: str, source_mapping: Dict[str, str]) -> Tuple[str, bytes]:
+    """Cache key for an answer generated from a prompt with a decoding mode."""
+    digest = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16)
+    # The source names end up in the answer but not in the prompt
+    digest.update("\0".join(source_mapping.values()).encode("utf-8"))
+    return mode, digest.digest()
+
+
+def get_cached_answer(key: Tuple[str, bytes]) -> Optional[str]:
+    """Returns a previously generated answer, if it is still cached."""
+    with _ANSWER_CACHE_LOCK:
+        answer = _ANSWER_CACHE.get(key)
+        if answer is not None:
+            _ANSWER_CACHE.move_to_end(key)
+        return answer
+
+
+def cache_answer(key: Tuple[str, bytes], answer: str):
+    """Stores a generated answer, evicting the least recently used one."""
+    with _ANSWER_CACHE_LOCK:
+        _ANSWER_CACHE[key] = answer
+        if len(_ANSWER_CACHE) > ANSWER_CACHE_SIZE:
+            _ANSWER_CACHE.popitem(last=False)
+
+
+def format_source_list(source_mapping: Dict[str, str]) -> str:
+    """Formats the sources block appended to an answer."""
+    return "\n\n**Sources:**\n" + \
+        "\n".join([f"* {sid}: {sname}" for sid,
+                   sname in source_mapping.items()])
+
+
+def is_no_answer(answer: str) -> bool:
+    """Whether the model said the context does not answer the query."""
+    return NO_ANSWER_RE.search(answer) is not None
+
+
 def synthesize_answer_with_llm(query: str, retrieved_chunks: List[Dict[str, Any]], model_name: str = "local") -> Optional[str]:
     """
     Generates a synthesized answer using a local LLM based on retrieved context.
@@ -62,58 +240,35 @@ def synthesize_answer_with_llm(query: str, retrieved_chunks: List[Dict[str, Any]
         return None
 
 
-    context_parts = []
-    source_mapping = {}
-    for i, chunk_data in enumerate(retrieved_chunks):
-        source_id = f"Source [{i+1}]"
-
-        chunk_text = chunk_data.get('text', '')
-
-        context_parts.append(f"{source_id}:\n{chunk_text[:1500]}")
-        source_mapping[source_id] = chunk_data.get('source', 'Unknown')
-
-
-    context_string = "\n\n".join(context_parts)
-
-    
-    if len(context_string) > 12000:
-        context_string = context_string[:12000] + "\n... [Context Truncated]"
-        logger.warning("Context string truncated due to length limit.")
-
-
-    prompt = f'''You are an AI assistant for the EduQuery college chatbot. Your primary goal is to provide a comprehensive and detailed answer to the user's query based *only* on the provided context paragraphs (labeled Source [1], Source [2], etc.). Do not use any external knowledge or information you might have.
-
-User Query: \\"{query}\\"
+    prompt, source_mapping = build_synthesis_prompt(query, retrieved_chunks)
+    cache_key = answer_cache_key(
+        f"beams={SYNTHESIS_NUM_BEAMS}", prompt, source_mapping)
+    cached_answer = get_cached_answer(cache_key)
+    if cached_answer is not None:
+        logger.info("Using cached synthesized answer.")
+        return cached_answer
 
-Context:
----
-{context_string}
----
-
-Instructions:
-1.  Carefully analyze the User Query and the provided Context paragraphs.
-2.  Synthesize a thorough and elaborate answer to the query using *only* information explicitly stated in the Context. Explain the concepts clearly and provide as much relevant detail as found in the sources.
-3.  If the context contains the answer, formulate it clearly and comprehensively. Cite the source(s) using the format (Source [N]) where the information was found. Combine information from multiple sources if needed, citing all relevant ones, and ensure the synthesized answer flows logically.
-4.  If the context *does not* contain sufficient information relevant to the query to provide a detailed answer, respond with: "The provided context does not contain specific information to answer this query in detail." Do not attempt to guess or infer an answer.
-5.  Structure the answer logically. Use bullet points or numbered lists if it helps clarity for complex information or steps.
-6.  If the context is too long or complex, summarize the key points before synthesizing the answer.
-Answer:
-'''
+    # Formatted before generating so nothing but the check below is left
+    # once the answer is ready
+    source_list = format_source_list(source_mapping)
 
     # --- Calling the Local LLM ---
     try:
         logger.info(
             f"Generating answer using local model from: {SYNTHESIS_MODEL_PATH}")
-        inputs = local_tokenizer(prompt, return_tensors="pt", max_length=1024, truncation=True).to(
+        inputs = local_tokenizer(prompt, return_tensors="pt", max_length=MAX_INPUT_TOKENS, truncation=True).to(
             local_model.device)
 
 
-        outputs = local_model.generate(
-            **inputs,
-            max_length=400,
-            num_beams=4,
-            early_stopping=True
-        )
+        # No autograd bookkeeping is needed for inference
+        with _GENERATE_LOCK, torch.inference_mode():
+            outputs = local_model.generate(
+                **inputs,
+                max_new_tokens=MAX_NEW_TOKENS,
+                num_beams=SYNTHESIS_NUM_BEAMS,
+                do_sample=False,
+                early_stopping=SYNTHESIS_NUM_BEAMS > 1
+            )
 
 
         synthesized_answer = local_tokenizer.decode(
@@ -125,15 +280,13 @@ Answer:
 
 
         
-        if "provided context does not have the answer" not in synthesized_answer and "insufficient information" not in synthesized_answer:
-            source_list = "\n\n**Sources:**\n" + \
-                "\n".join([f"* {sid}: {sname}" for sid,
-                          sname in source_mapping.items()])
+        if not is_no_answer(synthesized_answer):
             final_answer = synthesized_answer + source_list
         else:
             final_answer = synthesized_answer
 
         logger.info("Successfully synthesized answer using local model.")
+        cache_answer(cache_key, final_answer)
         return final_answer
 
     except Exception as e:
@@ -141,3 +294,79 @@ Answer:
             f"An unexpected error occurred during local synthesis: {e}")
         logger.error(traceback.format_exc())
         return "Error: An unexpected error occurred while generating the answer locally."
+
+
+def synthesize_answer_stream(query: str, retrieved_chunks: List[Dict[str, Any]]) -> Iterator[str]:
+    """
+    Generates an answer like synthesize_answer_with_llm, but yields it piece
+    by piece as the model produces it, followed by the source list.
+
+    Token streaming does not support beam search, so this decodes greedily.
+    """
+    if not local_model or not local_tokenizer:
+        logger.error(
+            f"Local model/tokenizer not initialized (path: {SYNTHESIS_MODEL_PATH}). Cannot synthesize answer.")
+        yield f"Error: Local synthesis model not configured or failed to load from '{SYNTHESIS_MODEL_PATH}'. Cannot generate answer."
+        return
+
+    if not retrieved_chunks:
+        logger.warning("No chunks provided for synthesis.")
+        return
+
+    prompt, source_mapping = build_synthesis_prompt(query, retrieved_chunks)
+    # Streaming always decodes greedily; with SYNTHESIS_NUM_BEAMS=1 it shares
+    # cached answers with synthesize_answer_with_llm
+    cache_key = answer_cache_key("beams=1", prompt, source_mapping)
+    cached_answer = get_cached_answer(cache_key)
+    if cached_answer is not None:
+        logger.info("Using cached synthesized answer.")
+        yield cached_answer
+        return
+
+    source_list = format_source_list(source_mapping)
+
+    logger.info(
+        f"Streaming answer using local model from: {SYNTHESIS_MODEL_PATH}")
+    streamer = TextIteratorStreamer(
+        local_tokenizer, skip_prompt=True, skip_special_tokens=True)
+    errors: List[Exception] = []
+
+    def generate():
+        try:
+            inputs = local_tokenizer(prompt, return_tensors="pt", max_length=MAX_INPUT_TOKENS, truncation=True).to(
+                local_model.device)
+            # inference_mode is per thread, so it is entered here
+            with _GENERATE_LOCK, torch.inference_mode():
+                local_model.generate(
+                    **inputs, max_new_tokens=MAX_NEW_TOKENS, do_sample=False, streamer=streamer)
+        except Exception as e:
+            errors.append(e)
+            logger.error(
+                f"An unexpected error occurred during local synthesis: {e}")
+            logger.error(traceback.format_exc())
+            # Unblock the consumer below
+            streamer.end()
+
+    # generate() runs in a worker thread and feeds the streamer
+    thread = Thread(target=generate, daemon=True)
+    thread.start()
+    pieces = []
+    for piece in streamer:
+        pieces.append(piece)
+        yield piece
+    thread.join()
+
+    synthesized_answer = "".join(pieces).strip()
+    if errors:
+        if synthesized_answer:
+            yield "\n\n"
+        yield "Error: An unexpected error occurred while generating the answer locally."
+    elif not synthesized_answer:
+        logger.error("Local model generated an empty response.")
+        yield "Error: Sorry, I couldn't generate a response at this time (empty local model response)."
+    elif is_no_answer(synthesized_answer):
+        cache_answer(cache_key, "".join(pieces))
+    else:
+        yield source_list
+        cache_answer(cache_key, "".join(pieces) + source_list)
+        logger.info("Successfully streamed answer using local model.")
@@ -1,54 +1,92 @@
 import os
-import PyPDF2 
 import logging
+import multiprocessing
 from docx import Document
 from pptx import Presentation
 import fitz  # PyMuPDF
 import pytesseract  # Added for OCR
 from PIL import Image  # Added for image handling with OCR
-import io  # Added for image stream handling
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List, Optional, Union
 from .simple_preprocess import preprocess_text
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Defined a threshold for minimum characters extracted by PyMuPDF to trigger OCR
-MIN_CHARS_FOR_NON_OCR = 100
+# Set in the worker processes of the extraction pool, which already runs
+# one document per core
+IN_EXTRACTION_WORKER = multiprocessing.parent_process() is not None
+
+# Pages OCR'd at once per PDF. pytesseract runs the tesseract binary in a
+# subprocess, so threads overlap them. Inside the extraction pool the cores
+# are taken, so pages go one at a time and tesseract (which inherits this
+# environment) is kept off OpenMP threads.
+OCR_WORKERS = 1 if IN_EXTRACTION_WORKER else min(4, os.cpu_count() or 1)
+if IN_EXTRACTION_WORKER:
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+def ocr_page_image(img: Image.Image, page_num: int, pdf_path: str) -> str:
+    """OCRs one rendered page, returning a placeholder if OCR fails."""
+    try:
+        ocr_text = pytesseract.image_to_string(img)
+        logger.info(f"OCR successful for page {page_num+1}.")
+        return ocr_text
+    except Exception as ocr_error:
+        logger.warning(
+            f"OCR failed for page {page_num+1} in {pdf_path}: {ocr_error}")
+        # Fallback: add placeholder if both failed significantly
+        return f"[Content from page {page_num+1} could not be extracted or OCR'd]"
 
 
 def extract_text_from_pdf(pdf_path: str) -> str:
     """Extracts text from a PDF file, handling potential OCR needs."""
-    text = ""
+    # Page texts in page order; OCR'd pages are futures until they finish
+    parts: List[Union[str, "Future[str]"]] = []
     try:
-        doc = fitz.open(pdf_path)
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            page_text = page.get_text()
-            if not page_text.strip():  # If text extraction yields little, trying OCR
-                logger.info(
-                    f"Page {page_num+1} in {pdf_path} has little text, attempting OCR.")
-                try:
-                    # Use the correct method get_pixmap()
-                    pix = page.get_pixmap()
-                    img_bytes = pix.tobytes("png")
-                    img = Image.open(io.BytesIO(img_bytes))
-                    ocr_text = pytesseract.image_to_string(img)
-                    text += ocr_text + "\n"
-                    logger.info(f"OCR successful for page {page_num+1}.")
-                except Exception as ocr_error:
-                    logger.warning(
-                        f"OCR failed for page {page_num+1} in {pdf_path}: {ocr_error}")
-                    # Fallback: add placeholder if both failed significantly
-                    if not page_text.strip():
-                        text += f"[Content from page {page_num+1} could not be extracted or OCR'd]\n"
-
-            else:
-                text += page_text + "\n"
-        doc.close()
+        # Closing the document frees MuPDF's native buffers even on errors.
+        # PyMuPDF is not thread safe, so pages are parsed and rendered here
+        # and only the OCR itself runs on the pool
+        with fitz.open(pdf_path) as doc, \
+                ThreadPoolExecutor(max_workers=OCR_WORKERS) as ocr_executor:
+            pending: "deque[Future[str]]" = deque()
+            for page_num in range(len(doc)):
+                page = doc.load_page(page_num)
+                page_text = page.get_text()
+                if not page_text.strip():  # No text layer on this page, trying OCR
+                    logger.info(
+                        f"Page {page_num+1} in {pdf_path} has no text layer, attempting OCR.")
+                    try:
+                        # Use the correct method get_pixmap()
+                        pix = page.get_pixmap()
+                        # Wrap the raw RGB samples directly instead of
+                        # encoding a PNG only to decode it again
+                        img = Image.frombytes(
+                            "RGB", (pix.width, pix.height), pix.samples)
+                        # frombytes copied the samples; free the native
+                        # pixmap now rather than when it is collected
+                        del pix
+                    except Exception as ocr_error:
+                        logger.warning(
+                            f"OCR failed for page {page_num+1} in {pdf_path}: {ocr_error}")
+                        parts.append(
+                            f"[Content from page {page_num+1} could not be extracted or OCR'd]")
+                        continue
+                    # Bound the rendered pages held in memory at once
+                    if len(pending) >= 2 * OCR_WORKERS:
+                        pending.popleft().result()
+                    future = ocr_executor.submit(
+                        ocr_page_image, img, page_num, pdf_path)
+                    pending.append(future)
+                    parts.append(future)
+                else:
+                    parts.append(page_text)
     except Exception as e:
         logger.error(f"Error processing PDF {pdf_path}: {e}")
-    return text
+    # Leaving the executor waited for every OCR future
+    return "".join((part if isinstance(part, str) else part.result()) + "\n"
+                   for part in parts)
 
 
 def extract_text_from_docx(file_path: str) -> str:
@@ -64,15 +102,21 @@ def extract_text_from_docx(file_path: str) -> str:
         if hasattr(prop, 'title') and prop.title:
             content.append(f"Document Title: {prop.title}")
 
+        # Heading styles are found once per document, so each paragraph
+        # needs one set lookup instead of checking its style's name
+        heading_style_ids = {style.style_id for style in doc.styles
+                             if isinstance(style.name, str) and style.name.startswith('Heading')}
+
         # Processing paragraphs
         for para in doc.paragraphs:
-            if para.text.strip():
-                if para.style and hasattr(para.style, 'name') and para.style.name and \
-                   isinstance(para.style.name, str) and para.style.name.startswith('Heading'):
+            para_text = para.text
+            if para_text.strip():
+                para_style = para.style
+                if para_style is not None and para_style.style_id in heading_style_ids:
                     # Adding formatting to preserve heading structure
-                    content.append(f"\n## {para.text} ##\n")
+                    content.append(f"\n## {para_text} ##\n")
                 else:
-                    content.append(para.text)
+                    content.append(para_text)
 
         # Processing tables
         for table in doc.tables:
@@ -94,7 +138,8 @@ def extract_text_from_docx(file_path: str) -> str:
 
 def extract_text_from_ppt(ppt_path: str) -> str:
     """Extracts text from a PPT or PPTX file."""
-    text = ""
+    # Collected and joined once; += on a str copies everything built so far
+    parts: List[str] = []
     try:
         prs = Presentation(ppt_path)
         for slide in prs.slides:
@@ -104,19 +149,20 @@ def extract_text_from_ppt(ppt_path: str) -> str:
                 if shape.has_text_frame:
                     for paragraph in shape.text_frame.paragraphs:
                         for run in paragraph.runs:
-                            text += run.text + " "
-                        text += "\n"  # Newline after each paragraph
+                            parts.append(run.text)
+                            parts.append(" ")
+                        parts.append("\n")  # Newline after each paragraph
 
             # Extract text from notes slide, checking existence first
             if slide.has_notes_slide and slide.notes_slide.notes_text_frame:
                 notes_text = slide.notes_slide.notes_text_frame.text
                 if notes_text.strip():  # Add notes only if they contain text
-                    text += "\n--- Notes ---\n"
-                    text += notes_text
-                    text += "\n--- End Notes ---\n"
+                    parts.append("\n--- Notes ---\n")
+                    parts.append(notes_text)
+                    parts.append("\n--- End Notes ---\n")
 
-            text += "\n--- End Slide ---\n"  # Separator between slides
+            parts.append("\n--- End Slide ---\n")  # Separator between slides
 
     except Exception as e:
         logger.error(f"Error processing PPT/PPTX {ppt_path}: {e}")
-    return text
+    return "".join(parts)